@@ -0,0 +1,264 @@
+"""
+Synthetic load benchmark for the bet / round engine.
+
+Drives bet_message_handler and run_round_for_group against a fake bot object
+(no network) and a throwaway SQLite file, then reports throughput, latency,
+settlement time, DB writes and peak RSS as JSON. Rounds run on a VirtualClock,
+so reveal pauses cost no wall time.
+
+    python bench_round_engine.py --groups 20 --bets-per-round 200 --rounds 5 \
+        --mix size=0.45,parity=0.45,number=0.10 --out bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, List
+
+# Configure the bot module before importing it
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_")
+os.environ.setdefault("DB_FILE", os.path.join(_TMP_DIR, "bench.db"))
+os.environ.setdefault("ROUND_INDEX_DIR", os.path.join(_TMP_DIR, "round_index"))
+os.environ.setdefault("BALANCE_JOURNAL_FILE", os.path.join(_TMP_DIR, "balance_journal.ndjson"))
+os.environ.setdefault("PORT", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import bot  # noqa: E402
+from clock import VirtualClock  # noqa: E402
+from storage import BACKENDS, open_storage  # noqa: E402
+
+WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+# -------------------------
+# Fakes
+# -------------------------
+class FakeBot:
+    """Stands in for telegram.Bot; records calls per method and per chat"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.per_chat = Counter()
+        self._message_id = 0
+
+    async def _record(self, method: str, chat_id: int):
+        self.calls[method] += 1
+        self.per_chat[chat_id] += 1
+        self._message_id += 1
+        return SimpleNamespace(message_id=self._message_id, chat_id=chat_id)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        return await self._record("send_message", chat_id)
+
+    async def set_chat_permissions(self, chat_id: int, permissions=None, **kwargs):
+        await self._record("set_chat_permissions", chat_id)
+        return True
+
+
+class FakeMessage:
+    def __init__(self, bot_: FakeBot, chat_id: int, text: str):
+        self._bot = bot_
+        self.chat_id = chat_id
+        self.text = text
+        self.replies: List[str] = []
+
+    async def reply_text(self, text: str, **kwargs):
+        self.replies.append(text)
+        return await self._bot._record("reply_text", self.chat_id)
+
+
+def make_update(bot_: FakeBot, chat_id: int, user_id: int, text: str):
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=chat_id, type="supergroup", title=f"bench {chat_id}"),
+        effective_user=SimpleNamespace(id=user_id, username=f"u{user_id}", first_name="Bench"),
+        message=FakeMessage(bot_, chat_id, text),
+    )
+
+
+class WriteCounter:
+    """Counts write statements issued through bot.get_db_connection"""
+
+    def __init__(self):
+        self.writes = 0
+        self._orig = bot.get_db_connection
+        bot.get_db_connection = self._connect
+
+    def _trace(self, stmt: str):
+        if stmt.lstrip().upper().startswith(WRITE_PREFIXES):
+            self.writes += 1
+
+    def _connect(self):
+        conn = self._orig()
+        conn.set_trace_callback(self._trace)
+        return conn
+
+
+# -------------------------
+# Workload
+# -------------------------
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        k, v = part.split("=")
+        mix[k.strip()] = float(v)
+    unknown = set(mix) - {"size", "parity", "number"}
+    if unknown:
+        raise SystemExit(f"unknown bet types in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def random_bet_text(rng: random.Random, mix: Dict[str, float]) -> str:
+    kind = rng.choices(list(mix), weights=list(mix.values()))[0]
+    amount = rng.choice((bot.MIN_BET, bot.MIN_BET * 2, bot.MIN_BET * 5, bot.MIN_BET * 10))
+    if kind == "size":
+        return f"/{rng.choice(('N', 'L'))}{amount}"
+    if kind == "parity":
+        return f"/{rng.choice(('C', 'Le'))}{amount}"
+    digits = "".join(str(rng.randint(0, 9)) for _ in range(rng.randint(1, 3)))
+    return f"/S{digits} {amount}"
+
+
+def seed_fixtures(group_ids: List[int], user_ids: List[int], balance: float):
+    bot.init_db()
+    conn = bot.get_db_connection()
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO groups(chat_id, title, approved, running, bet_mode, forced_outcome, last_round) VALUES (?, ?, 1, 1, 'random', NULL, 0)",
+            [(gid, f"bench {gid}") for gid in group_ids],
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO users(user_id, username, first_name, balance, total_deposited, total_bet_volume, current_streak, best_streak, created_at, start_bonus_given, start_bonus_progress) VALUES (?, ?, 'Bench', ?, 0, 0, 0, 0, ?, 1, 0)",
+            [(uid, f"u{uid}", balance, bot.now_iso()) for uid in user_ids],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+async def run_benchmark(args) -> Dict[str, object]:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    group_ids = [-1000000000000 - i for i in range(args.groups)]
+    user_ids = [100000 + i for i in range(args.users)]
+    seed_fixtures(group_ids, user_ids, args.balance)
+    bot.hmac_rng.seed(args.seed)
+    clock = VirtualClock()
+    bot.set_clock(clock)
+    driver = asyncio.create_task(clock.driver())
+
+    fake_bot = FakeBot()
+    app = SimpleNamespace(bot=fake_bot)
+    context = SimpleNamespace(bot=fake_bot, args=[])
+    writes = WriteCounter()
+
+    latencies: List[float] = []
+    accepted = 0
+    attempted = 0
+    bet_wall = 0.0
+    rounds = []
+
+    for round_no in range(args.rounds):
+        round_epoch = int(clock.time()) // bot.ROUND_SECONDS
+
+        writes_before = writes.writes
+        t_round = time.perf_counter()
+        for _ in range(args.bets_per_round * args.groups):
+            update = make_update(fake_bot, rng.choice(group_ids), rng.choice(user_ids), random_bet_text(rng, mix))
+            t0 = time.perf_counter()
+            await bot.bet_message_handler(update, context)
+            dt = time.perf_counter() - t0
+            latencies.append(dt)
+            attempted += 1
+            if update.message.replies and update.message.replies[0].startswith("✅"):
+                accepted += 1
+        bet_wall += time.perf_counter() - t_round
+        bet_writes = writes.writes - writes_before
+
+        writes_before = writes.writes
+        t_settle = time.perf_counter()
+        await asyncio.gather(*(bot.run_round_for_group(app, gid, round_epoch) for gid in group_ids))
+        bot.pot.flush()
+        settle_s = time.perf_counter() - t_settle
+        rounds.append({
+            "round": round_no,
+            "settlement_s": settle_s,
+            "settlement_per_group_ms": settle_s * 1000.0 / max(1, len(group_ids)),
+            "bet_writes": bet_writes,
+            "settlement_writes": writes.writes - writes_before,
+        })
+        clock.advance_to((round_epoch + 1) * bot.ROUND_SECONDS)
+    driver.cancel()
+
+    settle_times = [r["settlement_s"] for r in rounds]
+    return {
+        "config": {
+            "groups": args.groups,
+            "users": args.users,
+            "bets_per_round": args.bets_per_round,
+            "rounds": args.rounds,
+            "mix": mix,
+            "seed": args.seed,
+        },
+        "bets_attempted": attempted,
+        "bets_accepted": accepted,
+        "bets_per_s_accepted": accepted / bet_wall if bet_wall else 0.0,
+        "bet_latency_ms": {
+            "p50": percentile(latencies, 50) * 1000.0,
+            "p99": percentile(latencies, 99) * 1000.0,
+            "max": max(latencies) * 1000.0 if latencies else 0.0,
+        },
+        "settlement_s": {
+            "mean": sum(settle_times) / len(settle_times) if settle_times else 0.0,
+            "max": max(settle_times) if settle_times else 0.0,
+        },
+        "db_writes_per_round": (writes.writes / args.rounds) if args.rounds else 0,
+        "api_calls": dict(fake_bot.calls),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "rounds": rounds,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Round engine load benchmark")
+    p.add_argument("--groups", type=int, default=10)
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--bets-per-round", type=int, default=100, help="bets per group per round")
+    p.add_argument("--rounds", type=int, default=3)
+    p.add_argument("--mix", default="size=0.45,parity=0.45,number=0.10")
+    p.add_argument("--balance", type=float, default=10_000_000_000)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--storage", choices=sorted(BACKENDS), default="sqlite",
+                   help="storage backend (memory: nothing touches disk)")
+    p.add_argument("--out", default="", help="write JSON results to this file")
+    args = p.parse_args(argv)
+    if args.storage != "sqlite":
+        bot.set_storage(open_storage(args.storage))
+
+    results = asyncio.run(run_benchmark(args))
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    bot.stop_logging(bot.log_listener)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
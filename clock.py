@@ -0,0 +1,103 @@
+"""
+Injectable clocks for the round engine.
+
+SystemClock is the production clock. VirtualClock keeps its own notion of
+"now" and completes sleeps instantly in virtual time, so days of rounds can be
+replayed in seconds by simulate_rounds.py and the benchmarks.
+"""
+import asyncio
+import heapq
+import itertools
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+
+class SystemClock:
+    def time(self) -> float:
+        # Same epoch numbering round ids have always used (naive UTC -> timestamp)
+        return datetime.utcnow().timestamp()
+
+    def utcnow(self) -> datetime:
+        return datetime.utcnow()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+    async def run_in_executor(self, executor, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+class VirtualClock:
+    """Clock whose time only moves when every task is waiting on it.
+
+    Run ``driver()`` as a background task: whenever the event loop has gone
+    idle it jumps straight to the earliest pending wake-up. Without a driver,
+    time moves only through ``advance()``. Work handed to threads through
+    ``run_in_executor()`` counts as busy: time stands still until it returns.
+    """
+
+    def __init__(self, start: Optional[float] = None, idle_yields: int = 50):
+        self._now = float(start if start is not None else SystemClock().time())
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._idle_yields = idle_yields
+        self._pending: Optional[asyncio.Event] = None
+        self._busy = 0
+        self._idle: Optional[asyncio.Event] = None
+
+    def time(self) -> float:
+        return self._now
+
+    def utcnow(self) -> datetime:
+        # inverse of SystemClock.time(): utcnow().timestamp() == time()
+        return datetime.fromtimestamp(self._now)
+
+    async def sleep(self, seconds: float):
+        if seconds <= 0:
+            await asyncio.sleep(0)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (self._now + seconds, next(self._seq), fut))
+        if self._pending is not None:
+            self._pending.set()
+        await fut
+
+    async def run_in_executor(self, executor, fn, *args):
+        self._busy += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        finally:
+            self._busy -= 1
+            if not self._busy and self._idle is not None:
+                self._idle.set()
+
+    def advance(self, seconds: float):
+        """Move time forward, waking every sleeper that falls due"""
+        self.advance_to(self._now + seconds)
+
+    def advance_to(self, target: float):
+        if target > self._now:
+            self._now = target
+        while self._waiters and self._waiters[0][0] <= self._now:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+
+    async def driver(self):
+        """Advance to the next wake-up each time the loop has nothing else to run"""
+        self._pending = asyncio.Event()
+        self._idle = asyncio.Event()
+        while True:
+            for _ in range(self._idle_yields):
+                await asyncio.sleep(0)
+            if self._busy:
+                self._idle.clear()
+                await self._idle.wait()
+                continue
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)  # cancelled sleepers
+            if not self._waiters:
+                self._pending.clear()
+                await self._pending.wait()
+                continue
+            self.advance_to(self._waiters[0][0])
@@ -0,0 +1,103 @@
+"""
+Streaming exports of rounds, bets and the money tables for auditors.
+
+Rows come off one SQLite cursor in fetchmany() chunks and are written as they
+arrive, so memory stays flat however large the table is. Output is NDJSON or
+CSV, optionally gzip'd. The same export is available to admins as /export.
+
+    python export_data.py history --format csv --gzip --since 2026-01-01 --chat -1001234 --out history.csv.gz
+    python export_data.py withdrawals --until 2026-02-01 --out withdrawals.ndjson
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence
+
+FORMATS = ("ndjson", "csv")
+WRITE_CHUNK_ROWS = 1000  # rows buffered before each write
+
+
+def iter_cursor(cursor, chunk_rows: int = WRITE_CHUNK_ROWS) -> Iterator[Dict[str, Any]]:
+    """Yield a cursor's rows as dicts, fetching chunk_rows at a time"""
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        for r in rows:
+            yield dict(r)
+
+
+def parse_when(value: Optional[str]) -> Optional[datetime]:
+    """'2026-01-31' or any ISO timestamp -> naive UTC datetime, like now_iso() writes"""
+    return datetime.fromisoformat(value) if value else None
+
+
+def default_path(table: str, fmt: str, compress: bool) -> str:
+    return f"{table}_{datetime.utcnow():%Y%m%d_%H%M%S}.{fmt}" + (".gz" if compress else "")
+
+
+def write_export(rows: Iterable[Dict[str, Any]], columns: Sequence[str], path: str,
+                 fmt: str = "ndjson", compress: bool = False) -> int:
+    """Write rows to path (atomically, via a temp file) and return how many were written"""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}")
+    tmp = path + ".tmp"
+    count = 0
+    opener = gzip.open if compress else open
+    with opener(tmp, "wt", encoding="utf-8", newline="") as out:
+        chunk = []
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            for row in rows:
+                chunk.append([row.get(c) for c in columns])
+                if len(chunk) >= WRITE_CHUNK_ROWS:
+                    writer.writerows(chunk)
+                    count += len(chunk)
+                    chunk.clear()
+            writer.writerows(chunk)
+        else:
+            for row in rows:
+                chunk.append(json.dumps({c: row.get(c) for c in columns}, ensure_ascii=False, separators=(",", ":")))
+                if len(chunk) >= WRITE_CHUNK_ROWS:
+                    out.write("\n".join(chunk) + "\n")
+                    count += len(chunk)
+                    chunk.clear()
+            if chunk:
+                out.write("\n".join(chunk) + "\n")
+        count += len(chunk)
+    os.replace(tmp, path)
+    return count
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Stream a table to NDJSON/CSV for auditing")
+    p.add_argument("table", help="history, bets, settled_bets, deposits, withdrawals or ledger")
+    p.add_argument("--format", choices=FORMATS, default="ndjson")
+    p.add_argument("--gzip", action="store_true")
+    p.add_argument("--since", help="inclusive start (YYYY-MM-DD or ISO timestamp, UTC)")
+    p.add_argument("--until", help="exclusive end (YYYY-MM-DD or ISO timestamp, UTC)")
+    p.add_argument("--chat", type=int, help="only this group (history and bets)")
+    p.add_argument("--out", default="")
+    args = p.parse_args(argv)
+
+    os.environ.setdefault("PORT", "0")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import bot
+
+    path = args.out or default_path(args.table, args.format, args.gzip)
+    try:
+        count = bot.export_table(args.table, path, args.format, args.gzip,
+                                 parse_when(args.since), parse_when(args.until), args.chat)
+    except ValueError as e:
+        p.error(str(e))
+    print(f"{count} rows -> {path}", file=sys.stderr)
+    bot.stop_logging(bot.log_listener)
+
+
+if __name__ == "__main__":
+    main()
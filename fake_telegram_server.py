@@ -0,0 +1,336 @@
+"""
+Local stand-in for the Telegram Bot API, for end-to-end load tests.
+
+Implements the methods bot.py relies on (getMe, deleteWebhook, getUpdates,
+sendMessage, sendDocument, editMessageText, setChatPermissions,
+answerCallbackQuery) with
+configurable latency and Telegram-style 429 RetryAfter flood control, and
+records API calls per chat.
+
+    python fake_telegram_server.py --port 8081 --latency-ms 40 --jitter-ms 20
+    BOT_API_BASE_URL=http://127.0.0.1:8081/bot python bot.py
+
+Control endpoints (JSON):
+    POST /_inject   {"chat_id": -100, "user_id": 7, "text": "/N1000"}
+                    {"callback": {"chat_id": 7, "user_id": 7, "message_id": 1, "data": "..."}}
+                    {"updates": [<raw Update objects>]}   or a list of any of the above
+    GET  /_stats    per-chat / per-method call counts and throttling totals
+    POST /_reset    clear counters
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger("fake_telegram_server")
+
+BOT_USER = {"id": 1000001, "is_bot": True, "first_name": "Fake Lottery Bot", "username": "fake_lottery_bot",
+            "can_join_groups": True, "can_read_all_group_messages": True, "supports_inline_queries": False}
+
+# Parameters PTB sends JSON-encoded inside form fields
+JSON_FIELDS = {"chat_id", "message_id", "permissions", "reply_markup", "offset", "limit", "timeout",
+               "allowed_updates", "show_alert", "cache_time", "disable_web_page_preview",
+               "disable_notification", "reply_to_message_id", "allow_sending_without_reply",
+               "use_independent_chat_permissions", "drop_pending_updates", "disable_content_type_detection"}
+
+
+class TokenBucket:
+    def __init__(self, per_second: float, burst: float):
+        self.per_second = per_second
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def take(self) -> float:
+        """Consume one token; return 0 on success or seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.per_second)
+        self.last = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.per_second
+
+
+class FakeBotAPI:
+    def __init__(self, latency_ms: float = 30.0, jitter_ms: float = 15.0,
+                 group_per_minute: float = 20.0, private_per_second: float = 1.0,
+                 global_per_second: float = 30.0, no_admin_chats: Optional[List[int]] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.group_per_minute = group_per_minute
+        self.private_per_second = private_per_second
+        self.global_bucket = TokenBucket(global_per_second, global_per_second)
+        self.no_admin_chats = set(no_admin_chats or [])
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._message_ids: Counter = Counter()
+        self._updates: List[Dict[str, Any]] = []
+        self._next_update_id = 1
+        self._updates_cond = asyncio.Condition()
+        self.reset()
+
+    def reset(self):
+        self.calls: Counter = Counter()
+        self.per_chat: Dict[int, Counter] = defaultdict(Counter)
+        self.throttled: Counter = Counter()
+        self.started = time.time()
+
+    # -------------------------
+    # helpers
+    # -------------------------
+    async def _latency(self):
+        delay = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000.0
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _bucket_for(self, chat_id: int) -> TokenBucket:
+        b = self._chat_buckets.get(chat_id)
+        if b is None:
+            if chat_id < 0:
+                b = TokenBucket(self.group_per_minute / 60.0, self.group_per_minute)
+            else:
+                b = TokenBucket(self.private_per_second, max(1.0, self.private_per_second * 3))
+            self._chat_buckets[chat_id] = b
+        return b
+
+    def _flood_check(self, chat_id: int) -> float:
+        wait = self.global_bucket.take()
+        if wait:
+            return wait
+        return self._bucket_for(chat_id).take()
+
+    @staticmethod
+    def _chat(chat_id: int) -> Dict[str, Any]:
+        if chat_id < 0:
+            return {"id": chat_id, "type": "supergroup", "title": f"Load test {chat_id}"}
+        return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+
+    def _message(self, chat_id: int, text: str, sender: Dict[str, Any], message_id: Optional[int] = None) -> Dict[str, Any]:
+        if message_id is None:
+            self._message_ids[chat_id] += 1
+            message_id = self._message_ids[chat_id]
+        return {"message_id": message_id, "date": int(time.time()), "chat": self._chat(chat_id),
+                "from": sender, "text": text}
+
+    @staticmethod
+    def ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def error(code: int, description: str, parameters: Optional[Dict[str, Any]] = None) -> web.Response:
+        body: Dict[str, Any] = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    def _record(self, method: str, chat_id: Optional[int]):
+        self.calls[method] += 1
+        if chat_id is not None:
+            self.per_chat[chat_id][method] += 1
+
+    # -------------------------
+    # updates
+    # -------------------------
+    async def push_updates(self, items: List[Dict[str, Any]]):
+        async with self._updates_cond:
+            for item in items:
+                item = dict(item)
+                item["update_id"] = self._next_update_id
+                self._next_update_id += 1
+                self._updates.append(item)
+            self._updates_cond.notify_all()
+
+    def build_update(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        if "callback" in spec:
+            cb = spec["callback"]
+            user = {"id": int(cb["user_id"]), "is_bot": False, "first_name": f"User {cb['user_id']}"}
+            chat_id = int(cb.get("chat_id", cb["user_id"]))
+            return {"callback_query": {
+                "id": str(random.getrandbits(48)), "from": user, "chat_instance": str(chat_id),
+                "data": cb["data"],
+                "message": self._message(chat_id, cb.get("text", ""), BOT_USER, int(cb.get("message_id", 1))),
+            }}
+        user_id = int(spec["user_id"])
+        user = {"id": user_id, "is_bot": False, "first_name": spec.get("first_name", f"User {user_id}"),
+                "username": spec.get("username", f"user{user_id}")}
+        chat_id = int(spec.get("chat_id", user_id))
+        msg = self._message(chat_id, spec["text"], user)
+        if spec["text"].startswith("/"):
+            cmd_len = len(spec["text"].split()[0])
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": cmd_len}]
+        return {"message": msg}
+
+    # -------------------------
+    # request handling
+    # -------------------------
+    @staticmethod
+    async def _params(request: web.Request) -> Dict[str, Any]:
+        params: Dict[str, Any] = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                form = await request.post()
+                params.update({k: v for k, v in form.items() if isinstance(v, (str, web.FileField))})
+        for k in list(params):
+            v = params[k]
+            if k in JSON_FIELDS and isinstance(v, str):
+                try:
+                    params[k] = json.loads(v)
+                except ValueError:
+                    pass
+        return params
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        handler = getattr(self, f"m_{method}", None)
+        if handler is None:
+            return self.error(404, "Not Found: method not found")
+        params = await self._params(request)
+        await self._latency()
+        return await handler(params)
+
+    async def m_getme(self, params):
+        self._record("getMe", None)
+        return self.ok(BOT_USER)
+
+    async def m_deletewebhook(self, params):
+        self._record("deleteWebhook", None)
+        if params.get("drop_pending_updates"):
+            self._updates.clear()
+        return self.ok(True)
+
+    async def m_getupdates(self, params):
+        self._record("getUpdates", None)
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        async with self._updates_cond:
+            # confirm everything below offset, as Telegram does
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            if not self._updates and timeout > 0:
+                try:
+                    await asyncio.wait_for(self._updates_cond.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            batch = [u for u in self._updates if u["update_id"] >= offset][:limit]
+        return self.ok(batch)
+
+    async def m_sendmessage(self, params):
+        chat_id = int(params["chat_id"])
+        wait = self._flood_check(chat_id)
+        if wait:
+            self.throttled[chat_id] += 1
+            retry_after = max(1, math.ceil(wait))
+            return self.error(429, f"Too Many Requests: retry after {retry_after}", {"retry_after": retry_after})
+        self._record("sendMessage", chat_id)
+        return self.ok(self._message(chat_id, str(params.get("text", "")), BOT_USER))
+
+    async def m_senddocument(self, params):
+        chat_id = int(params["chat_id"])
+        wait = self._flood_check(chat_id)
+        if wait:
+            self.throttled[chat_id] += 1
+            retry_after = max(1, math.ceil(wait))
+            return self.error(429, f"Too Many Requests: retry after {retry_after}", {"retry_after": retry_after})
+        self._record("sendDocument", chat_id)
+        upload = params.get("document")
+        if isinstance(upload, web.FileField):
+            name, size = upload.filename, len(upload.file.read())
+        else:  # file_id or URL of an earlier upload
+            name, size = None, 0
+        file_id = f"doc{random.getrandbits(48):x}"
+        msg = self._message(chat_id, "", BOT_USER)
+        del msg["text"]
+        msg["caption"] = str(params.get("caption", ""))
+        msg["document"] = {"file_id": file_id, "file_unique_id": file_id, "file_name": name, "file_size": size}
+        return self.ok(msg)
+
+    async def m_editmessagetext(self, params):
+        if "inline_message_id" in params:
+            self._record("editMessageText", None)
+            return self.ok(True)
+        chat_id = int(params["chat_id"])
+        self._record("editMessageText", chat_id)
+        return self.ok(self._message(chat_id, str(params.get("text", "")), BOT_USER, int(params["message_id"])))
+
+    async def m_setchatpermissions(self, params):
+        chat_id = int(params["chat_id"])
+        self._record("setChatPermissions", chat_id)
+        if chat_id in self.no_admin_chats:
+            return self.error(400, "Bad Request: not enough rights to change chat permissions")
+        return self.ok(True)
+
+    async def m_answercallbackquery(self, params):
+        self._record("answerCallbackQuery", None)
+        return self.ok(True)
+
+    # -------------------------
+    # control endpoints
+    # -------------------------
+    async def handle_inject(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        specs = body if isinstance(body, list) else [body]
+        items: List[Dict[str, Any]] = []
+        for spec in specs:
+            if "updates" in spec:
+                items.extend(spec["updates"])
+            else:
+                items.append(self.build_update(spec))
+        await self.push_updates(items)
+        return web.json_response({"ok": True, "queued": len(items)})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "elapsed_s": time.time() - self.started,
+            "methods": dict(self.calls),
+            "per_chat": {str(cid): dict(c) for cid, c in self.per_chat.items()},
+            "throttled": {str(cid): n for cid, n in self.throttled.items()},
+            "pending_updates": len(self._updates),
+        })
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"ok": True})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/_inject", self.handle_inject)
+        app.router.add_get("/_stats", self.handle_stats)
+        app.router.add_post("/_reset", self.handle_reset)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        return app
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8081)
+    p.add_argument("--latency-ms", type=float, default=30.0)
+    p.add_argument("--jitter-ms", type=float, default=15.0)
+    p.add_argument("--group-per-minute", type=float, default=20.0, help="sendMessage budget per group chat")
+    p.add_argument("--private-per-second", type=float, default=1.0, help="sendMessage budget per private chat")
+    p.add_argument("--global-per-second", type=float, default=30.0, help="sendMessage budget across all chats")
+    p.add_argument("--no-admin-chat", type=int, action="append", default=[],
+                   help="chat id where setChatPermissions fails for lack of rights (repeatable)")
+    args = p.parse_args(argv)
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    async def build():
+        api = FakeBotAPI(args.latency_ms, args.jitter_ms, args.group_per_minute,
+                         args.private_per_second, args.global_per_second, args.no_admin_chat)
+        return api.make_app()
+
+    web.run_app(build(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
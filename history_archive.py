@@ -0,0 +1,64 @@
+"""
+Compressed, append-only archive segments for old history rounds.
+
+Each segment is a gzip'd NDJSON file holding the rounds of one group over a
+contiguous epoch range; the (chat_id, epoch range) -> file index lives in the
+history_archive_segments table so lookups open exactly one segment.
+"""
+import gzip
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+# Fields persisted per round; independent of the live table layout
+ARCHIVE_FIELDS = ("round_index", "round_id", "result_size", "result_parity", "digits",
+                  "timestamp", "server_seed", "commitment", "revealed")
+
+
+class HistoryArchive:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def segment_path(self, chat_id: int, epoch_from: int, epoch_to: int) -> str:
+        return os.path.join(self.directory, str(chat_id), f"{chat_id}_{epoch_from}_{epoch_to}.ndjson.gz")
+
+    def write_segment(self, chat_id: int, epoch_from: int, epoch_to: int, rows: Iterable[Dict[str, Any]]) -> str:
+        """Write a segment atomically (temp file + fsync + rename) and return its path.
+
+        Names are derived from the range, so re-archiving the same rounds after a
+        crash rewrites the same file instead of leaving a duplicate behind.
+        """
+        path = self.segment_path(chat_id, epoch_from, epoch_to)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6, mtime=0) as gz:
+                for row in rows:
+                    record = {k: row.get(k) for k in ARCHIVE_FIELDS}
+                    gz.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp, path)
+        return path
+
+    @staticmethod
+    def iter_segment(path: str) -> Iterator[Dict[str, Any]]:
+        """Stream every record of one segment, in epoch order"""
+        with gzip.open(path, "rb") as gz:
+            for line in gz:
+                yield json.loads(line)
+
+    @staticmethod
+    def read_round(path: str, round_index: int) -> Optional[Dict[str, Any]]:
+        """Stream one segment and return the record for round_index, if present"""
+        try:
+            with gzip.open(path, "rb") as gz:
+                for line in gz:
+                    record = json.loads(line)
+                    if record["round_index"] == round_index:
+                        return record
+                    if record["round_index"] > round_index:
+                        break  # segments are written in epoch order
+        except FileNotFoundError:
+            return None
+        return None
@@ -0,0 +1,55 @@
+"""
+Leader election between bot processes on one host, through an flock()'d file.
+
+Whoever holds the exclusive lock is the leader. The kernel drops the lock
+the moment its holder exits or dies, so a standby blocked in acquire() takes
+over at once: there is no lease to expire and no stale lock to clean up. The
+holder's pid is written into the file for operators.
+"""
+import fcntl
+import os
+from typing import Optional
+
+
+class LeaderLock:
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.held = False
+
+    def try_acquire(self) -> bool:
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self._claimed()
+        return True
+
+    def acquire(self):
+        """Block until the lock is ours; run it in a thread"""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._claimed()
+
+    def _claimed(self):
+        self.held = True
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, f"{os.getpid()}\n".encode(), 0)
+
+    def holder(self) -> Optional[int]:
+        """pid of the current (or last) leader, as it wrote it"""
+        try:
+            return int(os.pread(self._fd, 32, 0).decode().strip() or 0) or None
+        except ValueError:
+            return None
+
+    def release(self):
+        if self.held:
+            self.held = False
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self.release()
+        os.close(self._fd)
@@ -0,0 +1,82 @@
+"""
+In-memory ranked leaderboards over users columns.
+
+Each board keeps user -> score plus a list of (-score, user_id) kept sorted
+with bisect: top(k) is a slice and rank() a binary search, so the /top10 and
+/balances commands never scan the users table. An update finds its slot by
+binary search but the list insert/delete still shifts the tail, O(n) memmove;
+cheap at our user counts, and warm() builds each list with a single sort.
+"""
+from bisect import bisect_left, insort
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class Leaderboard:
+    def __init__(self):
+        self._scores: Dict[int, float] = {}
+        self._ranked: List[Tuple[float, int]] = []  # (-score, user_id), best first
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def set(self, user_id: int, score: float):
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            del self._ranked[bisect_left(self._ranked, (-old, user_id))]
+        self._scores[user_id] = score
+        insort(self._ranked, (-score, user_id))
+
+    def clear(self):
+        self._scores.clear()
+        self._ranked.clear()
+
+    def load(self, scores: Dict[int, float]):
+        """Replace the board with scores in one sort"""
+        self._scores = scores
+        self._ranked = sorted((-score, user_id) for user_id, score in scores.items())
+
+    def discard(self, user_id: int):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            del self._ranked[bisect_left(self._ranked, (-old, user_id))]
+
+    def top(self, k: int) -> List[Tuple[int, float]]:
+        return [(user_id, -neg) for neg, user_id in self._ranked[:k]]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based position, ties broken by lower user_id"""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return bisect_left(self._ranked, (-score, user_id)) + 1
+
+
+class Leaderboards:
+    """One Leaderboard per users column, fed whole users rows"""
+
+    def __init__(self, fields: Iterable[str]):
+        self.boards: Dict[str, Leaderboard] = {f: Leaderboard() for f in fields}
+
+    def __getitem__(self, field: str) -> Leaderboard:
+        return self.boards[field]
+
+    def observe(self, row: Dict[str, Any]):
+        user_id = row["user_id"]
+        for field, board in self.boards.items():
+            if field in row:
+                board.set(user_id, float(row[field] or 0))
+
+    def warm(self, rows: Iterable[Dict[str, Any]]) -> int:
+        scores: Dict[str, Dict[int, float]] = {f: {} for f in self.boards}
+        count = 0
+        for row in rows:
+            user_id = row["user_id"]
+            for field, board_scores in scores.items():
+                if field in row:
+                    board_scores[user_id] = float(row[field] or 0)
+            count += 1
+        for field, board in self.boards.items():
+            board.load(scores[field])
+        return count
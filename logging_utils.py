@@ -0,0 +1,122 @@
+"""
+Queued, structured logging with rate sampling for hot paths
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler runs the full formatter (time, level, traceback) in the
+    calling thread so the record can be pickled; our queue is in-process, so
+    the caller only merges args into the message, which has to happen before
+    they can change, and enqueues.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class KV:
+    """``event key=value ...`` message, rendered only for records that get emitted."""
+    __slots__ = ("event", "fields")
+
+    def __init__(self, event: str, fields: Dict[str, object]):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self) -> str:
+        if not self.fields:
+            return self.event
+        parts = " ".join(f"{k}={v}" for k, v in self.fields.items())
+        return f"{self.event} {parts}"
+
+
+class RateSampler:
+    """Per-event token bucket: lets through ``per_second`` records (bursting to
+    ``burst``) and counts what it drops so the next emitted record can report it."""
+
+    def __init__(self, per_second: float, burst: Optional[int] = None):
+        self.per_second = float(per_second)
+        self.burst = float(burst if burst is not None else max(1, int(per_second)))
+        self._buckets: Dict[str, list] = {}  # event -> [tokens, last_ts, suppressed]
+        self._lock = threading.Lock()
+
+    def allow(self, event: str) -> Tuple[bool, int]:
+        """Return (allowed, suppressed_since_last_allowed)"""
+        if self.per_second <= 0:
+            return True, 0
+        now = time.monotonic()
+        with self._lock:
+            b = self._buckets.get(event)
+            if b is None:
+                b = self._buckets[event] = [self.burst, now, 0]
+            tokens = min(self.burst, b[0] + (now - b[1]) * self.per_second)
+            b[1] = now
+            if tokens >= 1.0:
+                b[0] = tokens - 1.0
+                suppressed, b[2] = b[2], 0
+                return True, suppressed
+            b[0] = tokens
+            b[2] += 1
+            return False, 0
+
+
+_sampler = RateSampler(per_second=5)
+_running = set()  # listeners started and not yet stopped
+
+
+def setup_logging(level: int = logging.INFO, fmt: str = LOG_FORMAT,
+                  sample_per_second: Optional[float] = None) -> logging.handlers.QueueListener:
+    """Route the root logger through a queue drained by a background thread"""
+    global _sampler
+    if sample_per_second is not None:
+        _sampler = RateSampler(per_second=sample_per_second)
+
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(fmt))
+    listener = logging.handlers.QueueListener(q, stream, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers[:] = [DeferredQueueHandler(q)]
+    root.setLevel(level)
+    listener.start()
+    _running.add(listener)
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+def stop_logging(listener: logging.handlers.QueueListener):
+    """Drain pending records and stop the listener thread (idempotent)"""
+    if listener in _running:
+        _running.discard(listener)
+        listener.stop()
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields):
+    """Emit a structured key/value record"""
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s", KV(event, fields), extra={"event": event, "fields": fields})
+
+
+def log_sampled(logger: logging.Logger, event: str, level: int = logging.INFO, **fields):
+    """Emit a structured record for a high-frequency event, subject to rate sampling"""
+    if not logger.isEnabledFor(level):
+        return
+    allowed, suppressed = _sampler.allow(event)
+    if not allowed:
+        return
+    if suppressed:
+        fields["suppressed"] = suppressed
+    logger.log(level, "%s", KV(event, fields), extra={"event": event, "fields": fields})
@@ -0,0 +1,142 @@
+"""
+Fixed-size binary round records, one append-mostly file per group.
+
+Record n of a group's file describes round epoch ``base_epoch + n``, so a
+lookup is one offset computation on a read-only mmap: /verify and /commit
+stay constant-time however long the history grows, and never touch SQLite.
+Gaps (epochs a group did not play) are left as holes and read back as empty
+records.
+
+    header : magic "RIDX", version, record size, base epoch
+    record : epoch, packed digits, flags, server seed (32 bytes), commitment (32 bytes)
+"""
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, NamedTuple, Optional
+
+MAGIC = b"RIDX"
+VERSION = 1
+HEADER = struct.Struct("<4sHHq")
+RECORD = struct.Struct("<qqB7x32s32s")
+
+FLAG_COMMITTED = 1  # seed and commitment known
+FLAG_SETTLED = 2    # digits final
+
+
+class RoundRecord(NamedTuple):
+    epoch: int
+    digits: int
+    flags: int
+    server_seed: bytes
+    commitment: bytes
+
+    @property
+    def settled(self) -> bool:
+        return bool(self.flags & FLAG_SETTLED)
+
+
+class _GroupFile:
+    def __init__(self, path: str):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.base_epoch: Optional[int] = None
+        self.map: Optional[mmap.mmap] = None
+        if os.fstat(self.fd).st_size >= HEADER.size:
+            magic, version, record_size, base = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                raise ValueError(f"{path}: not a v{VERSION} round index")
+            self.base_epoch = base
+
+    def offset(self, epoch: int) -> Optional[int]:
+        if self.base_epoch is None or epoch < self.base_epoch:
+            return None
+        return HEADER.size + (epoch - self.base_epoch) * RECORD.size
+
+    def remap(self):
+        size = os.fstat(self.fd).st_size
+        if self.map is not None:
+            if len(self.map) == size:
+                return
+            self.map.close()
+            self.map = None
+        if size:
+            self.map = mmap.mmap(self.fd, size, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        os.close(self.fd)
+
+
+class RoundIndex:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._files: Dict[int, _GroupFile] = {}
+        self._lock = threading.Lock()
+
+    def path(self, chat_id: int) -> str:
+        return os.path.join(self.directory, f"{chat_id}.ridx")
+
+    def exists(self, chat_id: int) -> bool:
+        return os.path.exists(self.path(chat_id))
+
+    def _file(self, chat_id: int) -> _GroupFile:
+        f = self._files.get(chat_id)
+        if f is None:
+            os.makedirs(self.directory, exist_ok=True)
+            f = self._files[chat_id] = _GroupFile(self.path(chat_id))
+        return f
+
+    def base_epoch(self, chat_id: int) -> Optional[int]:
+        """First epoch the group's file can hold (None: no file, or nothing written yet)"""
+        with self._lock:
+            if chat_id not in self._files and not self.exists(chat_id):
+                return None
+            return self._file(chat_id).base_epoch
+
+    def drop(self, chat_id: int):
+        """Delete a group's file, e.g. to rebuild it from an earlier base epoch"""
+        with self._lock:
+            f = self._files.pop(chat_id, None)
+            if f is not None:
+                f.close()
+            if self.exists(chat_id):
+                os.remove(self.path(chat_id))
+
+    def write(self, chat_id: int, epoch: int, server_seed: bytes, commitment: bytes,
+              digits: int = 0, flags: int = FLAG_COMMITTED) -> bool:
+        """Write (or overwrite) the record for one round; False if it predates the file"""
+        with self._lock:
+            f = self._file(chat_id)
+            if f.base_epoch is None:
+                os.pwrite(f.fd, HEADER.pack(MAGIC, VERSION, RECORD.size, epoch), 0)
+                f.base_epoch = epoch
+            offset = f.offset(epoch)
+            if offset is None:
+                return False
+            os.pwrite(f.fd, RECORD.pack(epoch, digits, flags, server_seed, commitment), offset)
+            return True
+
+    def read(self, chat_id: int, epoch: int) -> Optional[RoundRecord]:
+        with self._lock:
+            if chat_id not in self._files and not self.exists(chat_id):
+                return None
+            f = self._file(chat_id)
+            offset = f.offset(epoch)
+            if offset is None:
+                return None
+            if f.map is None or offset + RECORD.size > len(f.map):
+                f.remap()  # the file grew since it was last mapped
+                if f.map is None or offset + RECORD.size > len(f.map):
+                    return None
+            record = RoundRecord(*RECORD.unpack_from(f.map, offset))
+        if not record.flags or record.epoch != epoch:
+            return None  # hole
+        return record
+
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
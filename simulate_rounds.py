@@ -0,0 +1,124 @@
+"""
+Accelerated, deterministic simulation of the live round loop.
+
+Runs the real rounds_loop plus synthetic bettors on a VirtualClock against a
+fake bot, so a day of rounds across many groups replays in seconds. The same
+--seed always produces the same results digest.
+
+    python simulate_rounds.py --groups 50 --hours 24 --bets-per-round 20 --seed 7 --out sim.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+_TMP_DIR = tempfile.mkdtemp(prefix="sim_")
+os.environ.setdefault("DB_FILE", os.path.join(_TMP_DIR, "sim.db"))
+os.environ.setdefault("ROUND_INDEX_DIR", os.path.join(_TMP_DIR, "round_index"))
+os.environ.setdefault("BALANCE_JOURNAL_FILE", os.path.join(_TMP_DIR, "balance_journal.ndjson"))
+os.environ.setdefault("PORT", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import bot  # noqa: E402
+from bench_round_engine import FakeBot, make_update, parse_mix, random_bet_text, seed_fixtures  # noqa: E402
+from clock import VirtualClock  # noqa: E402
+from storage import BACKENDS, open_storage  # noqa: E402
+
+# Fixed virtual start so runs are reproducible (2026-01-01T00:00:00)
+SIM_START = 1767225600.0
+
+
+async def bettor(clock: VirtualClock, fake_bot: FakeBot, rng: random.Random, chat_id: int,
+                 user_ids, mix, rate: float, stats: dict):
+    context = SimpleNamespace(bot=fake_bot, args=[])
+    while True:
+        await clock.sleep(rng.expovariate(rate))
+        update = make_update(fake_bot, chat_id, rng.choice(user_ids), random_bet_text(rng, mix))
+        await bot.bet_message_handler(update, context)
+        stats["attempted"] += 1
+        if update.message.replies and update.message.replies[0].startswith("✅"):
+            stats["accepted"] += 1
+
+
+async def run_simulation(args) -> dict:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    group_ids = [-1000000000000 - i for i in range(args.groups)]
+    user_ids = [100000 + i for i in range(args.users)]
+    seed_fixtures(group_ids, user_ids, args.balance)
+    bot.hmac_rng.seed(args.seed)
+
+    clock = VirtualClock(start=SIM_START)
+    bot.set_clock(clock)
+    fake_bot = FakeBot()
+    app = SimpleNamespace(bot=fake_bot)
+    stats = {"attempted": 0, "accepted": 0}
+    rate = args.bets_per_round / float(bot.ROUND_SECONDS)
+
+    wall0 = time.perf_counter()
+    tasks = [asyncio.create_task(clock.driver()), asyncio.create_task(bot.rounds_loop(app))]
+    if rate > 0:
+        tasks += [asyncio.create_task(bettor(clock, fake_bot, random.Random(rng.random()), gid, user_ids, mix, rate, stats))
+                  for gid in group_ids]
+    await clock.sleep(args.hours * 3600.0)
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    wall = time.perf_counter() - wall0
+
+    history = bot.db_query("SELECT chat_id, round_epoch, digits FROM history ORDER BY chat_id, round_epoch")
+    digest = hashlib.sha256("".join(f"{bot.make_round_id(r['chat_id'], r['round_epoch'])}:{bot.unpack_digits(r['digits'])};"
+                                    for r in history).encode()).hexdigest()
+    bot.ledger.materialize()
+    balances = bot.db_query("SELECT COALESCE(SUM(balance), 0) AS total FROM users")[0]["total"]
+    staked = len(user_ids) * args.balance - balances
+    return {
+        "config": vars(args),
+        "virtual_seconds": clock.time() - SIM_START,
+        "wall_seconds": wall,
+        "speedup": (clock.time() - SIM_START) / wall if wall else 0.0,
+        "rounds_settled": len(history),
+        "rounds_per_wall_s": len(history) / wall if wall else 0.0,
+        "bets_attempted": stats["attempted"],
+        "bets_accepted": stats["accepted"],
+        "unsettled_bets": bot.db_query("SELECT COUNT(*) AS n FROM bets")[0]["n"],
+        "net_player_loss": staked,
+        "pot": bot.get_pot_amount(),
+        "api_calls": dict(fake_bot.calls),
+        "results_digest": digest,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Virtual-time simulation of the round loop")
+    p.add_argument("--groups", type=int, default=10)
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--hours", type=float, default=1.0, help="virtual hours to simulate")
+    p.add_argument("--bets-per-round", type=float, default=10.0, help="mean bets per group per round")
+    p.add_argument("--mix", default="size=0.45,parity=0.45,number=0.10")
+    p.add_argument("--balance", type=float, default=10_000_000_000)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--storage", choices=sorted(BACKENDS), default="sqlite",
+                   help="storage backend (memory: nothing touches disk)")
+    p.add_argument("--out", default="")
+    args = p.parse_args(argv)
+    if args.storage != "sqlite":
+        bot.set_storage(open_storage(args.storage))
+
+    results = asyncio.run(run_simulation(args))
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    bot.stop_logging(bot.log_listener)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Storage backends behind bot.py's get_db_connection().
+
+Every read and write in the bot, including the multi-table settlement and
+ledger transactions, goes through one backend's connect(), which hands out a
+DB-API connection speaking the bot's SQLite dialect (rows as sqlite3.Row):
+
+- SQLiteStorage: the database file, a fresh connection per call, safe across
+  threads and processes. The production backend.
+- MemoryStorage: one private in-memory database and nothing on disk, for
+  benchmarks and tests that want the full handler set at memory speed. It
+  has a single connection, lent to one thread at a time: while a
+  settlement worker holds it, a query on the event loop waits for it, so
+  the settlement pool buys no parallelism on this backend.
+
+STORAGE_BACKEND=sqlite|memory picks one. This is a connection seam, not an
+entity store: handlers still issue SQL, so a backend has to hand out
+connections to SQLite (a file, memory, a replica) rather than to some other
+database. Swapping in a non-SQLite store would mean moving the user, group
+and bet queries behind methods here first.
+"""
+import abc
+import sqlite3
+import threading
+import urllib.parse
+from typing import Dict, Type
+
+
+class Storage(abc.ABC):
+    name = ""
+
+    @abc.abstractmethod
+    def connect(self):
+        """A connection the caller owns until it calls close()"""
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+
+    def connect(self):
+        if self.read_only:
+            # a standby tails another process's database and must never write to it
+            conn = sqlite3.connect(f"file:{urllib.parse.quote(self.path)}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+
+class _Checkout:
+    """The shared in-memory connection, held by one thread until close().
+
+    close() must be called on the thread that checked it out (the db_*
+    helpers do so in a finally): the lock it releases is owned by that thread.
+    """
+
+    def __init__(self, storage: "MemoryStorage"):
+        storage._lock.acquire()
+        storage._depth += 1
+        self._storage = storage
+        self._conn = storage._conn
+        self._held = True
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        if not self._held:
+            return
+        self._held = False
+        storage = self._storage
+        storage._depth -= 1
+        if not storage._depth and self._conn.in_transaction:
+            self._conn.rollback()  # what closing a file connection does to uncommitted work
+        storage._lock.release()
+
+
+class MemoryStorage(Storage):
+    """A single in-memory SQLite database; connections are checked out one thread at a time"""
+    name = "memory"
+
+    def __init__(self):
+        self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._depth = 0  # nested checkouts by the thread holding the lock
+
+    def connect(self):
+        return _Checkout(self)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+BACKENDS: Dict[str, Type[Storage]] = {"sqlite": SQLiteStorage, "memory": MemoryStorage}
+
+
+def open_storage(name: str, path: str = "") -> Storage:
+    if name not in BACKENDS:
+        raise ValueError(f"unknown storage backend {name!r} (expected one of: {', '.join(BACKENDS)})")
+    return SQLiteStorage(path) if name == "sqlite" else BACKENDS[name]()
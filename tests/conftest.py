@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# bot.py reads its configuration at import time
+_TMP_DIR = tempfile.mkdtemp(prefix="bot_tests_")
+os.environ.setdefault("DB_FILE", os.path.join(_TMP_DIR, "bot.db"))
+os.environ.setdefault("ROUND_INDEX_DIR", os.path.join(_TMP_DIR, "round_index"))
+os.environ.setdefault("BALANCE_JOURNAL_FILE", os.path.join(_TMP_DIR, "balance_journal.ndjson"))
+os.environ.setdefault("PORT", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from round_index import RoundIndex  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh database, ledger, pot and round index behind bot's globals"""
+    monkeypatch.setattr(bot, "storage", SQLiteStorage(str(tmp_path / "bot.db")))
+    bot.init_db()
+    monkeypatch.setattr(bot, "ledger", bot.BalanceLedger())
+    monkeypatch.setattr(bot, "pot", bot.PotAccumulator())
+    index = RoundIndex(str(tmp_path / "round_index"))
+    monkeypatch.setattr(bot, "round_records", index)
+    bot.user_cache.clear()
+    for board in bot.leaderboards.boards.values():
+        board.clear()
+    yield tmp_path
+    index.close()
+    bot.user_cache.clear()
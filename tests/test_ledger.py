@@ -0,0 +1,54 @@
+import asyncio
+
+import bot
+from journal_file import JournalFile
+
+
+def ledger_rows(user_id):
+    return [(r["delta"], r["kind"]) for r in bot.db_query("SELECT delta, kind FROM balance_ledger WHERE user_id=? ORDER BY id", (user_id,))]
+
+
+def test_replay_cuts_torn_last_line(db, monkeypatch):
+    path = str(db / "journal.ndjson")
+    journal = JournalFile(path)
+    monkeypatch.setattr(bot, "ledger", bot.BalanceLedger(journal))
+    bot.ensure_user(1)
+    bot.ledger.append([(1, 100.0, "deposit", None), (1, -30.0, "adjust", None)])
+    journal.close()
+    with open(path, "ab") as f:
+        f.write(b'{"seq":3,"user_id":1,"delta":-5')  # crash in the middle of a record
+
+    journal = JournalFile(path)
+    restarted = bot.BalanceLedger(journal)
+    monkeypatch.setattr(bot, "ledger", restarted)
+    restarted.load()
+    assert restarted.tail(1) == 70.0
+    with open(path, "rb") as f:
+        assert f.read().endswith(b"\n")
+
+    # new appends continue after the last whole record, and the flush stores each entry once
+    restarted.append([(1, 5.0, "bonus", None)])
+    assert asyncio.run(restarted.flush()) == 3
+    assert ledger_rows(1) == [(100.0, "deposit"), (-30.0, "adjust"), (5.0, "bonus")]
+    assert bot.db_query("SELECT journal_seq FROM ledger_state WHERE id=1")[0]["journal_seq"] == 3
+    journal.close()
+
+
+def test_replay_skips_entries_already_flushed(db, monkeypatch):
+    path = str(db / "journal.ndjson")
+    journal = JournalFile(path)
+    monkeypatch.setattr(bot, "ledger", bot.BalanceLedger(journal))
+    bot.ensure_user(1)
+    bot.ledger.append([(1, 50.0, "deposit", None)])
+    asyncio.run(bot.ledger.flush())
+    bot.ledger.append([(1, -20.0, "adjust", None)])
+    journal.close()
+
+    journal = JournalFile(path)
+    restarted = bot.BalanceLedger(journal)
+    monkeypatch.setattr(bot, "ledger", restarted)
+    restarted.load()
+    assert restarted.tail(1) == 30.0  # 50 from balance_ledger, -20 from the journal
+    asyncio.run(restarted.flush())
+    assert ledger_rows(1) == [(50.0, "deposit"), (-20.0, "adjust")]
+    journal.close()
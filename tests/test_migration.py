@@ -0,0 +1,54 @@
+import sqlite3
+
+import bot
+from storage import SQLiteStorage
+
+SEED_A = "ab" * 32
+SEED_B = "cd" * 32
+
+# bets/history/provable_rounds as the original release created them
+BASELINE_DDL = """
+CREATE TABLE bets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, round_id TEXT, user_id INTEGER,
+    bet_type TEXT, bet_value TEXT, amount REAL, timestamp TEXT
+);
+CREATE TABLE history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, round_index INTEGER, round_id TEXT,
+    result_size TEXT, result_parity TEXT, digits TEXT, timestamp TEXT, server_seed TEXT, commitment TEXT
+);
+CREATE TABLE provable_rounds (
+    round_id TEXT PRIMARY KEY, server_seed TEXT, commitment TEXT, revealed INTEGER DEFAULT 0, created_at TEXT
+);
+"""
+
+
+def test_compact_round_keys_from_baseline(tmp_path, monkeypatch):
+    path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_DDL)
+    conn.executemany("INSERT INTO bets(chat_id, round_id, user_id, bet_type, bet_value, amount, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)", [
+        (-100, "-100_5000", 7, "size", "small", 10.0, "2026-01-01T00:00:00"),
+        (-100, "garbage", 8, "size", "big", 5.0, "2026-01-01T00:00:00"),
+    ])
+    conn.executemany("INSERT INTO history(chat_id, round_index, round_id, digits, timestamp, server_seed) VALUES (?, ?, ?, ?, ?, ?)", [
+        (-100, 4999, "-100_4999", "654321", "2026-01-01T00:00:00", SEED_B),
+        (-100, 5000, "-100_5000", "123456", "2026-01-01T00:01:00", SEED_A),
+    ])
+    conn.execute("INSERT INTO provable_rounds(round_id, server_seed, revealed) VALUES (?, ?, 1)", ("-100_5000", SEED_A))
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(bot, "storage", SQLiteStorage(path))
+    bot.init_db()
+
+    assert [tuple(r) for r in bot.db_query("SELECT chat_id, round_epoch, user_id, amount FROM bets")] == [(-100, 5000, 7, 10.0)]
+    history = bot.db_query("SELECT round_epoch, digits, settled_at FROM history ORDER BY round_epoch")
+    assert [(r["round_epoch"], bot.unpack_digits(r["digits"])) for r in history] == [(4999, "654321"), (5000, "123456")]
+    assert all(r["settled_at"] for r in history)
+    seeds = bot.db_query("SELECT round_epoch, server_seed, revealed FROM provable_rounds ORDER BY round_epoch")
+    assert [tuple(r) for r in seeds] == [(4999, bytes.fromhex(SEED_B), 0), (5000, bytes.fromhex(SEED_A), 1)]
+    assert not bot.db_query("SELECT name FROM sqlite_master WHERE name LIKE '%_v0'")
+    assert bot.db_query("PRAGMA user_version")[0][0] == bot.SCHEMA_VERSION
+
+    bot.init_db()  # already migrated: a second start leaves the data alone
+    assert len(bot.db_query("SELECT * FROM history")) == 2
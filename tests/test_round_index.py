@@ -0,0 +1,37 @@
+from round_index import FLAG_COMMITTED, FLAG_SETTLED, RoundIndex
+
+CHAT_ID = -1001
+SEED = b"s" * 32
+COMMITMENT = b"c" * 32
+
+
+def test_holes_read_as_missing(tmp_path):
+    index = RoundIndex(str(tmp_path))
+    assert index.read(CHAT_ID, 100) is None  # no file yet
+    assert index.write(CHAT_ID, 100, SEED, COMMITMENT)
+    assert index.write(CHAT_ID, 103, SEED, COMMITMENT, digits=1123456, flags=FLAG_COMMITTED | FLAG_SETTLED)
+
+    assert index.read(CHAT_ID, 99) is None    # before the base epoch
+    assert index.read(CHAT_ID, 101) is None   # gap inside the file
+    assert index.read(CHAT_ID, 102) is None
+    assert index.read(CHAT_ID, 104) is None   # past the end
+    assert not index.write(CHAT_ID, 99, SEED, COMMITMENT)
+
+    first = index.read(CHAT_ID, 100)
+    assert (first.epoch, first.server_seed, first.settled) == (100, SEED, False)
+    last = index.read(CHAT_ID, 103)
+    assert (last.digits, last.settled) == (1123456, True)
+    index.close()
+
+
+def test_reopened_index_keeps_records_and_holes(tmp_path):
+    index = RoundIndex(str(tmp_path))
+    index.write(CHAT_ID, 10, SEED, COMMITMENT)
+    index.write(CHAT_ID, 12, SEED, COMMITMENT)
+    index.close()
+
+    reopened = RoundIndex(str(tmp_path))
+    assert reopened.base_epoch(CHAT_ID) == 10
+    assert reopened.read(CHAT_ID, 11) is None
+    assert reopened.read(CHAT_ID, 12).epoch == 12
+    reopened.close()
@@ -0,0 +1,82 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+from bench_round_engine import FakeBot, seed_fixtures
+from clock import VirtualClock
+from journal_file import JournalFile
+
+CHAT_ID = -1001
+USER_ID = 7
+EPOCH = 6000000
+
+
+@pytest.fixture
+def app(db, monkeypatch):
+    """A running group, a write-behind ledger and a virtual clock just past EPOCH's close"""
+    monkeypatch.setattr(bot, "clock", VirtualClock(start=(EPOCH + 1) * bot.ROUND_SECONDS))
+    journal = JournalFile(str(db / "journal.ndjson"))
+    monkeypatch.setattr(bot, "ledger", bot.BalanceLedger(journal))
+    monkeypatch.setattr(bot, "_epochs_deferred", False)
+    seed_fixtures([CHAT_ID], [USER_ID], 1000.0)
+    yield SimpleNamespace(bot=FakeBot())
+    journal.close()
+
+
+def run(coro):
+    async def main():
+        driver = asyncio.create_task(bot.clock.driver())
+        try:
+            return await coro
+        finally:
+            driver.cancel()
+    return asyncio.run(main())
+
+
+def place_bet():
+    bot.ledger.place_bet(bot.Bet(None, CHAT_ID, EPOCH, USER_ID, "size", "big", 10.0, bot.now_iso()))
+
+
+def settled_bets():
+    return [tuple(r) for r in bot.db_query("SELECT round_epoch, amount FROM settled_bets WHERE user_id=?", (USER_ID,))]
+
+
+def test_bet_placed_just_before_the_flush_settles_in_its_round(app):
+    place_bet()
+    assert not bot.db_query("SELECT id FROM bets")  # only journaled so far
+
+    assert run(bot.settle_epoch(app, EPOCH))
+    assert bot.db_query("SELECT COUNT(*) FROM history WHERE chat_id=? AND round_epoch=?", (CHAT_ID, EPOCH))[0][0] == 1
+    assert settled_bets() == [(EPOCH, 10.0)]
+    assert not bot.db_query("SELECT id FROM bets")
+
+
+def test_epoch_is_left_to_recovery_while_the_flush_fails(app, monkeypatch):
+    insert = bot.BalanceLedger._insert
+    broken = [True]
+
+    def flaky(*args):
+        if broken[0]:
+            raise sqlite3.OperationalError("disk I/O error")
+        return insert(*args)
+
+    monkeypatch.setattr(bot.BalanceLedger, "_insert", staticmethod(flaky))
+    place_bet()
+
+    async def scenario():
+        assert not await bot.settle_epoch(app, EPOCH)
+        assert not bot.db_query("SELECT * FROM history WHERE round_epoch=?", (EPOCH,))
+        broken[0] = False
+        await bot.clock.sleep(bot.ROUND_SECONDS)
+        assert await bot.settle_epoch(app, EPOCH + 1)
+
+    run(scenario())
+    # the deferred round never got a seed, so recovery refunds its stake
+    refunds = bot.db_query("SELECT delta FROM balance_ledger WHERE user_id=? AND kind='refund'", (USER_ID,))
+    assert [r["delta"] for r in refunds] == [10.0]
+    assert settled_bets() == [(EPOCH, 10.0)]
+    assert not bot.db_query("SELECT id FROM bets")
+    assert not bot._epochs_deferred
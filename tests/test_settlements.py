@@ -0,0 +1,61 @@
+import asyncio
+
+import bot
+
+CHAT_ID = -1001
+EPOCH = 5000
+
+
+def settlement(bet_id):
+    return {
+        "digits": bot.pack_digits("123456"), "settled_at": 1, "pot": 25.0,
+        "deltas": [[7, 19.5]], "streaks": [[7, 1], [8, 0]],
+        "bets": [[bet_id, 7, "size", "big", 10.0, 19.5, "2026-01-01T00:00:00"]],
+    }
+
+
+def place(user_id):
+    return bot.Bet(None, CHAT_ID, EPOCH, user_id, "size", "big", 10.0, "2026-01-01T00:00:00").insert()
+
+
+def paid(user_id):
+    return bot.db_query("SELECT COALESCE(SUM(delta), 0) AS s FROM balance_ledger WHERE user_id=? AND kind='payout'", (user_id,))[0]["s"]
+
+
+def pot_row():
+    return bot.db_query("SELECT amount FROM pot WHERE id=1")[0]["amount"]
+
+
+def test_recover_applies_written_settlement_once(db):
+    bot.ensure_user(7)
+    bot.ensure_user(8)
+    bet = place(7)
+    bot.SettlementJournal._write(CHAT_ID, EPOCH, settlement(bet.id))  # crash before the apply
+
+    assert asyncio.run(bot.settlements.recover()) == 1
+    bot.pot.flush()
+    assert paid(7) == 19.5
+    assert pot_row() == 25.0
+    assert bot.db_query("SELECT current_streak FROM users WHERE user_id=7")[0][0] == 1
+    assert bot.db_query("SELECT COUNT(*) FROM bets")[0][0] == 0
+    assert bot.db_query("SELECT won, payout FROM settled_bets WHERE id=?", (bet.id,))[0][:] == (1, 19.5)
+    assert bot.db_query("SELECT COUNT(*) FROM settlements")[0][0] == 0
+
+    assert asyncio.run(bot.settlements.recover()) == 0
+    bot.pot.flush()
+    assert paid(7) == 19.5
+    assert pot_row() == 25.0
+
+
+def test_recover_requeues_pot_share_lost_before_flush(db, monkeypatch):
+    bot.ensure_user(7)
+    bet = place(7)
+    assert asyncio.run(bot.settlements.settle(CHAT_ID, EPOCH, settlement(bet.id)))
+    assert bot.db_query("SELECT applied FROM settlements")[0][0] == 1
+
+    monkeypatch.setattr(bot, "pot", bot.PotAccumulator())  # crash: the pending pot share is gone
+    assert asyncio.run(bot.settlements.recover()) == 1
+    bot.pot.flush()
+    assert pot_row() == 25.0
+    assert paid(7) == 19.5  # the payout itself is not applied again
+    assert bot.db_query("SELECT COUNT(*) FROM settlements")[0][0] == 0